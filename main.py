@@ -2,13 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import json
+import mimetypes
+import re
+import time
+import calendar
+import bisect
+import threading
 import urllib.parse
 import os
-import tempfile
-from flask import Flask, make_response, render_template, request, send_from_directory
+from flask import Flask, Response, jsonify, make_response, render_template, request
 import datetime
+import requests.adapters
 from google.cloud import storage
 from google import auth
+from google.auth.transport.requests import AuthorizedSession
+from google.api_core.exceptions import NotFound
 
 app = Flask(__name__, static_url_path='/static')
 
@@ -17,9 +25,38 @@ os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'photo-gallery-336913-a3e805ba7d3
 PROJECT = 'photo-gallery-336913'
 GCS_BUCKET_NAME = 'xiaozhou-photo-gallery'
 GCS_SUBFOLDER = 'gallery/'
-GCS_CLIENT = storage.Client(PROJECT)
+
+# Each gunicorn worker serves SERVING_THREADS requests at once (see app.yaml), all sharing one client.
+# The session is only used for downloads, which are safe to share between threads, but its connection pool
+# must be at least as large as the number of threads,
+# otherwise concurrent downloads open and discard connections instead of keeping them alive between requests.
+SERVING_THREADS = int(os.environ.get('SERVING_THREADS', 8))
+GCS_POOL_SIZE = SERVING_THREADS
+GCS_MAX_RETRIES = 3
+# Media is streamed to the client in chunks of this size, so each request holds one chunk in memory at a time
+GCS_CHUNK_SIZE = 1024 * 1024
+
+def create_gcs_client():
+    # Scopes have to be requested here, the client doesn't add its own when it is given a session
+    credentials, _ = auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=GCS_POOL_SIZE,
+        pool_maxsize=GCS_POOL_SIZE,
+        max_retries=GCS_MAX_RETRIES,
+        pool_block=True
+    )
+    session.mount('https://', adapter)
+    return storage.Client(PROJECT, credentials=credentials, _http=session)
+
+GCS_CLIENT = create_gcs_client()
 GCS_BUCKET = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
 
+SEARCH_INDEX_TTL = 600
+SEARCH_MAX_RESULTS = 500
+SEARCH_INDEX_CACHE = {"loaded_at": 0, "data": None}
+SEARCH_INDEX_LOCK = threading.Lock()
+
 def get_gcs_json(filename):
     blob = GCS_BUCKET.blob(GCS_SUBFOLDER + filename)
     data = json.loads(blob.download_as_string(client=None))
@@ -28,6 +65,31 @@ def get_gcs_json(filename):
 def month_to_string(month):
     return datetime.date(int(month[:4]), int(month[4:6]), 1).strftime('%B %Y')
 
+def get_search_index():
+    # The index covers every month, so keep it in memory rather than fetching it per request
+    # Requests are served on several threads, only one of them reloads it when it expires
+    if time.time() - SEARCH_INDEX_CACHE["loaded_at"] > SEARCH_INDEX_TTL:
+        with SEARCH_INDEX_LOCK:
+            if time.time() - SEARCH_INDEX_CACHE["loaded_at"] > SEARCH_INDEX_TTL:
+                SEARCH_INDEX_CACHE["data"] = get_gcs_json('image_metadata/search_index.json')
+                SEARCH_INDEX_CACHE["loaded_at"] = time.time()
+    return SEARCH_INDEX_CACHE["data"]
+
+def date_to_local_time(date_string):
+    # Same convention as the local_time column of the search index: wall clock time encoded as UTC
+    return calendar.timegm(datetime.date.fromisoformat(date_string).timetuple())
+
+def intersect_sorted(rows, other_rows):
+    # Walk the shorter list and binary search the longer one
+    if len(rows) > len(other_rows):
+        rows, other_rows = other_rows, rows
+    result = []
+    for row in rows:
+        position = bisect.bisect_left(other_rows, row)
+        if position < len(other_rows) and other_rows[position] == row:
+            result.append(row)
+    return result
+
 @app.route("/_ah/warmup")
 def warmup():
     return make_response("Warm up", 200)
@@ -44,15 +106,100 @@ def index():
         })
     return render_template("index.html", gallery_list=new_list)
 
+def stream_blob(blob, start, length):
+    with blob.open('rb', chunk_size=GCS_CHUNK_SIZE) as reader:
+        reader.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = reader.read(min(GCS_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
 @app.route('/get_image/<object>')
 def get_image(object):
+    # Stream the blob rather than downloading it first: /tmp counts against instance memory on App Engine,
+    # and several concurrent video downloads would not fit. Range requests are needed for video seeking.
     object_path = urllib.parse.unquote(object)
-    object_name = os.path.basename(object_path)
-    blob = GCS_BUCKET.blob(os.path.join(GCS_SUBFOLDER, object_path))
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        fullpath = os.path.join(tmpdirname, object_name)
-        blob.download_to_filename(fullpath)
-        return send_from_directory(tmpdirname, object_name)
+    blob = GCS_BUCKET.get_blob(os.path.join(GCS_SUBFOLDER, object_path))
+    if blob is None:
+        return make_response("Not found", 404)
+
+    mimetype = blob.content_type or mimetypes.guess_type(object_path)[0] or 'application/octet-stream'
+    headers = {'Accept-Ranges': 'bytes', 'ETag': blob.etag}
+
+    if request.range is None:
+        headers['Content-Length'] = str(blob.size)
+        return Response(stream_blob(blob, 0, blob.size), 200, headers=headers, mimetype=mimetype)
+
+    byte_range = request.range.range_for_length(blob.size)
+    if byte_range is None:
+        headers['Content-Range'] = 'bytes */{}'.format(blob.size)
+        return Response(status=416, headers=headers)
+
+    start, stop = byte_range
+    headers['Content-Length'] = str(stop - start)
+    headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1, blob.size)
+    return Response(stream_blob(blob, start, stop - start), 206, headers=headers, mimetype=mimetype)
+
+@app.route("/api/search", methods=['GET'])
+def search():
+    """
+    Searches all months for items by date range, type and description keywords.
+    Query parameters (all optional): start and end as YYYY-MM-DD (inclusive), type (image or video),
+    q with space separated keywords that must all be present, and limit.
+    """
+    args = request.args
+    try:
+        start = date_to_local_time(args["start"]) if args.get("start") else float("-inf")
+        end = date_to_local_time(args["end"]) + 24 * 60 * 60 if args.get("end") else float("inf")
+        limit = min(int(args.get("limit", SEARCH_MAX_RESULTS)), SEARCH_MAX_RESULTS)
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return make_response(jsonify(error="Invalid start, end or limit"), 400)
+
+    try:
+        search_index = get_search_index()
+    except NotFound:
+        return make_response(jsonify(error="Search index is not available yet"), 503)
+
+    # Rows are sorted by time, so the date range is a contiguous slice
+    first_row = bisect.bisect_left(search_index["local_time"], start)
+    last_row = bisect.bisect_left(search_index["local_time"], end)
+
+    tokens = re.findall(r"\w+", args.get("q", "").lower())
+    if tokens:
+        rows = None
+        for token in tokens:
+            token_rows = search_index["tokens"].get(token, [])
+            rows = token_rows if rows is None else intersect_sorted(rows, token_rows)
+        rows = rows[bisect.bisect_left(rows, first_row):bisect.bisect_left(rows, last_row)]
+    else:
+        rows = range(first_row, last_row)
+
+    item_type = args.get("type")
+    if item_type:
+        if item_type not in search_index["types"]:
+            rows = []
+        else:
+            type_number = search_index["types"].index(item_type)
+            rows = [row for row in rows if search_index["type"][row] == type_number]
+
+    results = []
+    for row in rows:
+        if len(results) >= limit:
+            break
+        results.append({
+            "name": search_index["name"][row],
+            "month": search_index["months"][search_index["month"][row]],
+            "type": search_index["types"][search_index["type"][row]],
+            "unix_time": search_index["unix_time"][row],
+            "src": urllib.parse.quote(search_index["src"][row], safe=''),
+            "thumbnail": urllib.parse.quote(search_index["thumbnail"][row], safe=''),
+        })
+    return jsonify(count=len(rows), results=results)
 
 @app.route("/gallery", methods=['GET'])
 def gallery():
@@ -90,4 +237,4 @@ def gallery():
     )
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    app.run(host="0.0.0.0", port=8080, debug=True, threaded=True)
@@ -1,3 +1,4 @@
+import os
 import json
 import requests
 import shutil
@@ -5,6 +6,13 @@ from exif import Image as ExifImage
 from PIL import Image as PillowImage
 from PIL import ExifTags
 from datetime import datetime
+import hash_index as spg_hash_index
+
+# Re-posted photos are the same image re-encoded, so only near-identical hashes count as duplicates.
+# Looser distances start matching different photos of the same room taken in a burst.
+DUPLICATE_HASH_DISTANCE = 2
+# Image ids to always keep, even if they look like a duplicate of another photo
+KEEP_DUPLICATES = []
 
 def get_img(url, filename):
     res = requests.get(url, stream = True)
@@ -59,12 +67,25 @@ if __name__ == "__main__":
                 item['imageId']: item['createdAt']
             })
             all_imgs.append(item['imageId'])
-    unique_imgs = list(set(all_imgs))
+    unique_imgs = sorted(set(all_imgs))
+
+    # The same photo is often posted several times under different ids, skip the copies
+    hash_index = spg_hash_index.PerceptualHashIndex(
+        'bh_phash_index.json', DUPLICATE_HASH_DISTANCE, KEEP_DUPLICATES
+    )
     for i in range(len(unique_imgs)):
         img = unique_imgs[i]
         ts = image_creation_date_map[img]
         filename = "nursery_{}".format(timestamp_to_filename(ts))
         exif_ts = timestamp_to_exif_dt(ts)
         source_img_path = "bh_photos/{}.jpg".format(img)
+        img_hash = hash_index.get_hash(img, source_img_path)
+        duplicates = hash_index.find_duplicates(img_hash, exclude=img)
+        duplicate_of = duplicates[0][0] if duplicates else None
+        hash_index.add(img, img_hash, os.path.getmtime(source_img_path), duplicate_of)
+        if duplicate_of is not None:
+            print('Skipping {}, duplicate of {} (distance {})'.format(img, duplicate_of, duplicates[0][1]))
+            continue
         out_img_path = "bh_photos_processed/{}_{}.jpg".format(filename, str(i))
-        write_image_exif(source_img_path, out_img_path, exif_ts)
\ No newline at end of file
+        write_image_exif(source_img_path, out_img_path, exif_ts)
+    hash_index.save()
\ No newline at end of file
@@ -1,12 +1,17 @@
 import os
+import re
+import html
 import glob
+import shutil
 from pathlib import Path
 import json
 from collections import OrderedDict
 import time
+import calendar
 from datetime import datetime
 import simplegallery.common as spg_common
 import media as spg_media
+import hash_index as spg_hash_index
 
 def check_correct_thumbnail_size(thumbnail_path, expected_height):
     """
@@ -29,6 +34,61 @@ def get_thumbnail_name(thumbnails_path, photo_name):
     return os.path.join(thumbnails_path, photo_name_without_extension + ".jpg")
 
 
+def tokenize_description(description):
+    """
+    Splits an image description into lowercase search tokens
+    :param description: Image description as stored in the images data file
+    :return: Set of tokens
+    """
+    return set(re.findall(r"\w+", html.unescape(description).lower()))
+
+
+def create_search_index(metadata_path, months):
+    """
+    Creates the search_index.json file with a compact, columnar index of the items of all months.
+    Rows are sorted by local_time so date ranges can be found with a binary search, and the description tokens are
+    stored as an inverted index mapping each token to the sorted list of row numbers containing it.
+    local_time is the wall clock time the item was taken at, encoded as if it were UTC, so date queries don't depend
+    on the timezone of the build machine or of the server.
+    :param metadata_path: Path to the folder containing the images data file of each month
+    :param months: List of month names, e.g. 202107
+    """
+    items = []
+    for month_number, month in enumerate(months):
+        with open(os.path.join(metadata_path, "{}.json".format(month)), "r") as images_data_in:
+            images_data = json.load(images_data_in)
+        for name, image_data in images_data.items():
+            # unix_time was computed with mktime on this machine, so converting it back gives the original local time
+            local_time = calendar.timegm(
+                datetime.fromtimestamp(image_data["unix_time"]).timetuple()
+            )
+            items.append((local_time, month_number, name, image_data))
+    items.sort(key=lambda x: (x[0], x[1], x[2]))
+
+    types = sorted({image_data["type"] for _, _, _, image_data in items})
+    search_index = {
+        "months": months,
+        "types": types,
+        "local_time": [local_time for local_time, _, _, _ in items],
+        "unix_time": [image_data["unix_time"] for _, _, _, image_data in items],
+        "month": [month_number for _, month_number, _, _ in items],
+        "type": [types.index(image_data["type"]) for _, _, _, image_data in items],
+        "name": [name for _, _, name, _ in items],
+        "src": [image_data["src"] for _, _, _, image_data in items],
+        "thumbnail": [image_data["thumbnail"] for _, _, _, image_data in items],
+        "tokens": {},
+    }
+    for row, (_, _, _, image_data) in enumerate(items):
+        for token in tokenize_description(image_data["description"]):
+            search_index["tokens"].setdefault(token, []).append(row)
+
+    # Written without whitespace as it is loaded in full by the app
+    with open(os.path.join(metadata_path, "search_index.json"), "w", encoding="utf-8") as search_index_out:
+        json.dump(search_index, search_index_out, separators=(",", ":"))
+
+    spg_common.log(f"Search index items: {len(items)}")
+
+
 class FilesGalleryLogic():
     """
     Gallery logic for a gallery composed of photos and videos stored as local files.
@@ -40,12 +100,60 @@ class FilesGalleryLogic():
     """
     THUMBNAIL_SIZE_FACTOR = 2
 
-    def __init__(self, gallery_config):
+    def __init__(self, gallery_config, hash_index=None):
         """
         Initializes the gallery logic
         :param gallery_config: Gallery config dictionary as read from the gallery.json
+        :param hash_index: Optional perceptual hash index shared between galleries, used to skip duplicate photos
+        and videos. Its keys are paths relative to the public folder. The caller saves it once all galleries are built.
         """
         self.gallery_config = gallery_config
+        self.hash_index = hash_index
+        self.duplicate_checks = {}
+        self.moved_duplicates = set()
+
+    def check_duplicate(self, image):
+        """
+        Checks if a media file is a duplicate or near-duplicate of a file already in the hash index.
+        Files are added to the index as they are checked, so the first copy found is the one that is kept.
+        If "duplicates_path" is set in the gallery config, duplicates are moved there so they aren't uploaded.
+        :param image: Path to the media file
+        :return: index key of the file it duplicates, or None if it is not a duplicate or no hash index is configured
+        """
+        if self.hash_index is None:
+            return None
+
+        if image in self.duplicate_checks:
+            return self.duplicate_checks[image]
+
+        key = os.path.relpath(image, self.gallery_config["public_path"])
+        if self.hash_index.is_original(key, image):
+            self.duplicate_checks[image] = None
+            return None
+
+        hash_string = self.hash_index.get_hash(key, image)
+
+        duplicate_of = None
+        for match, _ in self.hash_index.find_duplicates(hash_string, exclude=key):
+            # Drop entries of files that have been deleted since they were indexed
+            if os.path.exists(os.path.join(self.gallery_config["public_path"], match)):
+                duplicate_of = match
+                break
+            self.hash_index.remove(match)
+
+        self.hash_index.add(key, hash_string, os.path.getmtime(image), duplicate_of)
+        if duplicate_of is not None:
+            spg_common.log(f"Skipping {key}, duplicate of {duplicate_of}")
+            if "duplicates_path" in self.gallery_config:
+                Path(self.gallery_config["duplicates_path"]).mkdir(parents=True, exist_ok=True)
+                shutil.move(
+                    image,
+                    os.path.join(self.gallery_config["duplicates_path"], os.path.basename(image)),
+                )
+                self.moved_duplicates.add(os.path.basename(image))
+
+        self.duplicate_checks[image] = duplicate_of
+        return duplicate_of
 
     def create_images_data_file(self):
         """
@@ -81,7 +189,9 @@ class FilesGalleryLogic():
         thumbnails_path = self.gallery_config["thumbnails_path"]
         Path(thumbnails_path).mkdir(parents=True, exist_ok=True)
 
-        photos = glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
+        photos = sorted(
+            glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
+        )
 
         if not photos:
             raise spg_common.SPGException(
@@ -89,7 +199,13 @@ class FilesGalleryLogic():
             )
 
         count_thumbnails_created = 0
+        count_duplicates_skipped = 0
         for photo in photos:
+            # Don't generate thumbnails for duplicates of photos that are already in the gallery
+            if self.check_duplicate(photo) is not None:
+                count_duplicates_skipped += 1
+                continue
+
             thumbnail_path = get_thumbnail_name(thumbnails_path, photo)
 
             # Check if the thumbnail should be generated. This happens if one of the following applies:
@@ -105,6 +221,8 @@ class FilesGalleryLogic():
                 count_thumbnails_created += 1
 
         spg_common.log(f"New thumbnails generated: {count_thumbnails_created}")
+        if self.hash_index is not None:
+            spg_common.log(f"Duplicates skipped: {count_duplicates_skipped}")
 
     def format_image_date(self, timestamp):
         """
@@ -138,10 +256,19 @@ class FilesGalleryLogic():
             glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
         )
 
+        # Duplicates moved out of the images folder are no longer part of the gallery
+        for photo_name in self.moved_duplicates:
+            images_data.pop(photo_name, None)
+
         # Get the required metadata for each image
         for image in images:
             photo_name = os.path.basename(image)
 
+            # Leave duplicates out of the gallery, they have no thumbnail
+            if self.check_duplicate(image) is not None:
+                images_data.pop(photo_name, None)
+                continue
+
             thumbnail_path = get_thumbnail_name(
                 self.gallery_config["thumbnails_path"], image
             )
@@ -184,11 +311,20 @@ class FilesGalleryLogic():
 if __name__ == "__main__":
     root_dir = "/Users/xiaozhouwang/Documents/gallery/"
     gallery_dir = root_dir + "gallery_images/*"
-    sub_gallery_list = glob.glob(gallery_dir, recursive = False)
+    sub_gallery_list = sorted(glob.glob(gallery_dir, recursive = False))
+    # One index for the whole library, so copies of a photo in different months are found too
+    hash_index = spg_hash_index.PerceptualHashIndex(
+        "{}/image_metadata/phash_index.json".format(root_dir),
+        spg_hash_index.DEFAULT_MAX_DISTANCE,
+        # Paths relative to root_dir of files to keep even if they look like duplicates
+        keep=[],
+    )
+    months = []
     for sub_gallery in sub_gallery_list:
         folder_name = os.path.basename(os.path.normpath(sub_gallery))
         gallery_json = {
             "images_data_file": "{}/image_metadata/{}.json".format(root_dir, folder_name),
+            "duplicates_path": "{}/gallery_duplicates/{}/".format(root_dir, folder_name),
             "public_path": root_dir,
             "images_path": "{}/gallery_images/{}/".format(root_dir, folder_name),
             "thumbnails_path": "{}/gallery_thumbnails/{}/".format(root_dir, folder_name),
@@ -196,6 +332,9 @@ if __name__ == "__main__":
             "background_photo_offset": 30,
             "date_format": "Photo Date: %d %B %Y %H:%M:%S"
         }
-        gallery_logic = FilesGalleryLogic(gallery_json)
+        gallery_logic = FilesGalleryLogic(gallery_json, hash_index)
         gallery_logic.create_thumbnails()
         gallery_logic.create_images_data_file()
+        months.append(folder_name)
+    hash_index.save()
+    create_search_index(root_dir + "image_metadata/", months)
@@ -0,0 +1,155 @@
+import os
+import json
+import numpy as np
+import media as spg_media
+
+# Maximum Hamming distance (in bits, out of 64) between two perceptual hashes for the media files to be
+# considered duplicates. Small values only catch re-encoded or resized copies, larger ones also catch crops and edits.
+# A distance of 0 only treats files with identical hashes as duplicates.
+DEFAULT_MAX_DISTANCE = 6
+
+# Number of set bits for every possible byte value, used to count differing bits of XORed hashes
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hashes, query):
+    """
+    Computes the Hamming distance between a query hash and every hash of an array
+    :param hashes: numpy uint64 array of hashes
+    :param query: hash to compare against as an integer
+    :return: numpy array with the number of differing bits for each hash
+    """
+    differences = np.bitwise_xor(hashes, np.uint64(query))
+    return POPCOUNT_TABLE[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PerceptualHashIndex():
+    """
+    Persistent index of the perceptual hashes of media files, used to find duplicate and near-duplicate photos
+    and videos before they are thumbnailed or uploaded.
+    """
+
+    def __init__(self, index_path, max_distance=DEFAULT_MAX_DISTANCE, keep=()):
+        """
+        Loads the index from disk, or starts an empty one if the file doesn't exist yet
+        :param index_path: Path to the JSON file storing the index
+        :param max_distance: Maximum Hamming distance for two files to be considered duplicates
+        :param keep: Keys of files that are never treated as duplicates, and never cause another file to be one
+        """
+        self.index_path = index_path
+        self.max_distance = max_distance
+        self.keep = set(keep)
+
+        if os.path.exists(index_path):
+            with open(index_path, "r") as index_in:
+                self.entries = json.load(index_in)
+        else:
+            self.entries = {}
+
+        self._build_lookup()
+
+    @staticmethod
+    def _is_searchable(entry):
+        """
+        Checks if an index entry can be matched against, i.e. it has a hash and is not itself a duplicate
+        :param entry: Index entry
+        :return: True if the entry is used for lookups
+        """
+        return entry["hash"] is not None and entry.get("duplicate_of") is None
+
+    def _build_lookup(self):
+        """
+        Rebuilds the arrays used for vectorized lookups from the index entries
+        """
+        self.keys = [key for key, entry in self.entries.items() if self._is_searchable(entry)]
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        self.hashes = np.array(
+            [int(self.entries[key]["hash"], 16) for key in self.keys], dtype=np.uint64
+        )
+
+    def get_hash(self, key, media_path):
+        """
+        Gets the perceptual hash of a media file, reusing the stored hash if the file hasn't changed since it was indexed
+        :param key: Name under which the file is stored in the index
+        :param media_path: Path to the media file
+        :return: hash as a 16 character hex string, or None if the file is too flat to hash
+        """
+        mtime = os.path.getmtime(media_path)
+        if key in self.entries and self.entries[key]["mtime"] == mtime:
+            return self.entries[key]["hash"]
+        return spg_media.get_perceptual_hash(media_path)
+
+    def is_original(self, key, media_path):
+        """
+        Checks if a file is already stored as an original (not a duplicate) and hasn't changed since.
+        Originals are not checked again, so files indexed later can't cause a different copy to be kept.
+        :param key: Name under which the file is stored in the index
+        :param media_path: Path to the media file
+        :return: True if the file is an unchanged original
+        """
+        entry = self.entries.get(key)
+        return (
+            entry is not None
+            and entry.get("duplicate_of") is None
+            and entry["mtime"] == os.path.getmtime(media_path)
+        )
+
+    def find_duplicates(self, hash_string, exclude=None):
+        """
+        Finds the indexed files whose hash is within the maximum distance of the given hash
+        :param hash_string: hash as a hex string, or None for files that couldn't be hashed
+        :param exclude: key to leave out of the results, usually the file being checked itself
+        :return: list of (key, distance) tuples sorted by distance, empty if the excluded key is in the keep list.
+        Files in the keep list are never returned.
+        """
+        if not self.keys or hash_string is None or exclude in self.keep:
+            return []
+
+        distances = hamming_distances(self.hashes, int(hash_string, 16))
+        matches = np.flatnonzero(distances <= self.max_distance)
+        matches = matches[np.argsort(distances[matches], kind="stable")]
+
+        return [
+            (self.keys[i], int(distances[i]))
+            for i in matches
+            if self.keys[i] != exclude and self.keys[i] not in self.keep
+        ]
+
+    def add(self, key, hash_string, mtime, duplicate_of=None):
+        """
+        Adds or updates a file in the index. Duplicates are stored too so their hash doesn't have to be recomputed,
+        but they are not matched against.
+        :param key: Name under which the file is stored in the index
+        :param hash_string: hash as a hex string, or None if the file couldn't be hashed
+        :param mtime: modification time of the file when it was hashed
+        :param duplicate_of: key of the file this one duplicates, if any
+        """
+        entry = {"hash": hash_string, "mtime": mtime, "duplicate_of": duplicate_of}
+        self.entries[key] = entry
+
+        if key in self.positions:
+            if self._is_searchable(entry):
+                self.hashes[self.positions[key]] = np.uint64(int(hash_string, 16))
+            else:
+                self._build_lookup()
+        elif self._is_searchable(entry):
+            self.positions[key] = len(self.keys)
+            self.keys.append(key)
+            self.hashes = np.append(self.hashes, np.uint64(int(hash_string, 16)))
+
+    def remove(self, key):
+        """
+        Removes a file from the index, e.g. when it no longer exists
+        :param key: Name under which the file is stored in the index
+        """
+        if key in self.entries:
+            del self.entries[key]
+            if key in self.positions:
+                self._build_lookup()
+
+    def save(self):
+        """
+        Writes the index to disk
+        """
+        with open(self.index_path, "w", encoding="utf-8") as index_out:
+            json.dump(self.entries, index_out, indent=4, separators=(",", ": "))
@@ -204,6 +204,87 @@ def get_video_size(video):
     return image.shape[1], image.shape[0]
 
 
+def _dct_matrix(size):
+    """
+    Builds the orthonormal DCT-II basis matrix used by the perceptual hash
+    :param size: number of samples along one axis
+    :return: size x size numpy array
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0, :] = np.sqrt(1.0 / size)
+    return matrix
+
+
+PHASH_IMAGE_SIZE = 32
+PHASH_HASH_SIZE = 8
+PHASH_DCT_MATRIX = _dct_matrix(PHASH_IMAGE_SIZE)
+
+# Standard deviation (0-255 grey levels) below which an image is too flat to hash, e.g. a black or faded frame
+PHASH_MIN_STD = 4.0
+
+
+def compute_perceptual_hash(gray_pixels):
+    """
+    Computes a 64 bit perceptual hash (pHash) of a greyscale image
+    :param gray_pixels: 2D numpy array of the image downscaled to PHASH_IMAGE_SIZE x PHASH_IMAGE_SIZE
+    :return: hash as a 16 character hex string, or None if the image is too flat for the hash to be meaningful
+    """
+    pixels = np.asarray(gray_pixels, dtype=np.float64)
+
+    # Flat images all hash to the same value (or to floating point noise), so they can't be compared
+    if pixels.std() < PHASH_MIN_STD:
+        return None
+
+    dct = PHASH_DCT_MATRIX @ pixels @ PHASH_DCT_MATRIX.T
+    low_frequencies = dct[:PHASH_HASH_SIZE, :PHASH_HASH_SIZE].flatten()
+    # Exclude the DC term from the median, it only carries the overall brightness
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return "{:016x}".format(int(np.packbits(bits).view(">u8")[0]))
+
+
+def get_perceptual_hash(media_path):
+    """
+    Gets the perceptual hash of a media file (image or video).
+    Videos are hashed by their middle frame, as the first frame is often black or a fade-in.
+    :param media_path: Path to the media file
+    :return: hash as a 16 character hex string, or None if the image or frame is too flat to hash
+    """
+    size = (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+
+    if (
+        media_path.lower().endswith(".jpg")
+        or media_path.lower().endswith(".jpeg")
+        or media_path.lower().endswith(".gif")
+        or media_path.lower().endswith(".png")
+    ):
+        image = Image.open(media_path)
+        image = rotate_image_by_orientation(image)
+        gray_pixels = np.asarray(image.convert("L").resize(size, Image.LANCZOS))
+        image.close()
+    elif media_path.lower().endswith(".mp4"):
+        video_capture = cv2.VideoCapture(media_path)
+        frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 2)
+        success, frame = video_capture.read()
+        if not success:
+            # Some containers don't support seeking, fall back to the first frame
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = video_capture.read()
+        video_capture.release()
+        if not success:
+            return None
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray_pixels = cv2.resize(gray_frame, size, interpolation=cv2.INTER_AREA)
+    else:
+        raise SPGException(
+            f"Unsupported file type ({os.path.basename(media_path)})"
+        )
+
+    return compute_perceptual_hash(gray_pixels)
+
+
 def get_image_description(image_path):
     """
     Gets the description of an image from the ImageDescription tag as a utf-8 string
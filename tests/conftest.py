@@ -0,0 +1,21 @@
+import os
+import sys
+
+import google.auth
+from google.auth.credentials import AnonymousCredentials
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+# The build scripts import each other as top level modules
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+
+# main creates its GCS client on import, so credentials are faked before any test imports it
+REQUESTED_SCOPES = []
+
+
+def fake_default(scopes=None, **kwargs):
+    REQUESTED_SCOPES.append(scopes)
+    return AnonymousCredentials(), "test-project"
+
+
+google.auth.default = fake_default
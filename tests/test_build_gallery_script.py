@@ -0,0 +1,52 @@
+import os
+import shutil
+
+import hash_index as spg_hash_index
+from build_gallery_script import FilesGalleryLogic
+from test_hash_index import make_photo
+
+
+def make_gallery(root, month, hash_index):
+    images_path = os.path.join(root, "gallery_images", month)
+    os.makedirs(images_path, exist_ok=True)
+    gallery_config = {
+        "public_path": root,
+        "images_path": images_path,
+        "duplicates_path": os.path.join(root, "gallery_duplicates", month),
+    }
+    return images_path, FilesGalleryLogic(gallery_config, hash_index)
+
+
+def test_duplicates_across_months_are_moved_out(tmp_path):
+    root = str(tmp_path)
+    hash_index = spg_hash_index.PerceptualHashIndex(os.path.join(root, "index.json"))
+    january_path, january = make_gallery(root, "202101", hash_index)
+    february_path, february = make_gallery(root, "202102", hash_index)
+    original = make_photo(os.path.join(january_path, "original.png"))
+    copy = make_photo(os.path.join(february_path, "copy.jpg"), size=(200, 150), quality=60)
+
+    assert january.check_duplicate(original) is None
+    assert february.check_duplicate(copy) == os.path.join("gallery_images", "202101", "original.png")
+    assert not os.path.exists(copy)
+    assert os.path.exists(os.path.join(root, "gallery_duplicates", "202102", "copy.jpg"))
+
+    images_data = {"copy.jpg": {}}
+    february.generate_images_data(images_data)
+    assert images_data == {}
+
+
+def test_originals_are_not_checked_again(tmp_path):
+    root = str(tmp_path)
+    hash_index = spg_hash_index.PerceptualHashIndex(os.path.join(root, "index.json"))
+    images_path, gallery = make_gallery(root, "202101", hash_index)
+    first = make_photo(os.path.join(images_path, "b.png"))
+    gallery.check_duplicate(first)
+
+    # A copy indexed later, e.g. one on the keep list, must not make the original a duplicate on the next build
+    second = os.path.join(images_path, "a.png")
+    shutil.copy2(first, second)
+    hash_index.keep.add(os.path.join("gallery_images", "202101", "a.png"))
+    _, next_build = make_gallery(root, "202101", hash_index)
+    assert next_build.check_duplicate(second) is None
+    assert next_build.check_duplicate(first) is None
+    assert os.path.exists(first) and os.path.exists(second)
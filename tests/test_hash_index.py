@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+import hash_index as spg_hash_index
+import media as spg_media
+
+
+def make_photo(path, size=(400, 300), flip=False, quality=None):
+    # Smooth gradients with a few shapes, close enough to a photo for the hash to be stable
+    x, y = np.meshgrid(np.linspace(0, 1, 400), np.linspace(0, 1, 300))
+    pixels = 255 * (0.5 * x + 0.3 * np.sin(6 * y) ** 2)
+    pixels[50:150, 80:200] = 230
+    pixels[180:260, 250:360] = 20
+    if flip:
+        pixels = pixels[::-1]
+    image = Image.fromarray(pixels.astype(np.uint8)).convert("RGB").resize(size)
+    if quality is None:
+        image.save(path)
+    else:
+        image.save(path, quality=quality)
+    return str(path)
+
+
+def test_hamming_distances():
+    hashes = np.array([0, 0xFFFFFFFFFFFFFFFF, 0b1011], dtype=np.uint64)
+    assert spg_hash_index.hamming_distances(hashes, 0).tolist() == [0, 64, 3]
+
+
+def test_flat_images_have_no_hash():
+    for level in (0, 1, 16, 128, 255):
+        assert spg_media.compute_perceptual_hash(np.full((32, 32), level)) is None
+
+
+def test_resized_and_reencoded_copies_are_close(tmp_path):
+    original = spg_media.get_perceptual_hash(make_photo(tmp_path / "original.png"))
+    copy = spg_media.get_perceptual_hash(
+        make_photo(tmp_path / "copy.jpg", size=(200, 150), quality=60)
+    )
+    different = spg_media.get_perceptual_hash(make_photo(tmp_path / "flipped.png", flip=True))
+
+    distances = spg_hash_index.hamming_distances(
+        np.array([int(copy, 16), int(different, 16)], dtype=np.uint64), int(original, 16)
+    )
+    assert distances[0] <= spg_hash_index.DEFAULT_MAX_DISTANCE
+    assert distances[1] > spg_hash_index.DEFAULT_MAX_DISTANCE
+
+
+def test_add_find_remove(tmp_path):
+    index = spg_hash_index.PerceptualHashIndex(str(tmp_path / "index.json"))
+    index.add("a", "00000000000000ff", 1.0)
+    index.add("b", "00000000000000fe", 1.0)
+    index.add("c", "ffffffffffffffff", 1.0)
+    index.add("d", None, 1.0)
+
+    assert index.find_duplicates("00000000000000ff", exclude="a") == [("b", 1)]
+    assert index.find_duplicates("00000000000000ff") == [("a", 0), ("b", 1)]
+    assert index.find_duplicates(None) == []
+
+    index.remove("b")
+    assert index.find_duplicates("00000000000000ff", exclude="a") == []
+
+
+def test_duplicates_are_stored_but_not_matched(tmp_path):
+    index = spg_hash_index.PerceptualHashIndex(str(tmp_path / "index.json"))
+    index.add("a", "00000000000000ff", 1.0)
+    index.add("b", "00000000000000ff", 1.0, duplicate_of="a")
+
+    assert index.find_duplicates("00000000000000ff") == [("a", 0)]
+    assert index.entries["b"]["duplicate_of"] == "a"
+
+
+def test_save_and_reload(tmp_path):
+    index_path = str(tmp_path / "index.json")
+    index = spg_hash_index.PerceptualHashIndex(index_path)
+    index.add("a", "00000000000000ff", 1.0)
+    index.add("b", "00000000000000ff", 2.0, duplicate_of="a")
+    index.add("c", None, 3.0)
+    index.save()
+
+    reloaded = spg_hash_index.PerceptualHashIndex(index_path)
+    assert reloaded.entries == index.entries
+    assert reloaded.keys == ["a"]
+    assert reloaded.find_duplicates("00000000000000fe") == [("a", 1)]
+
+
+def test_get_hash_reuses_stored_hash(tmp_path):
+    photo = make_photo(tmp_path / "photo.png")
+    index = spg_hash_index.PerceptualHashIndex(str(tmp_path / "index.json"))
+    index.add("photo", "0123456789abcdef", os.path.getmtime(photo))
+    assert index.get_hash("photo", photo) == "0123456789abcdef"
+
+    os.utime(photo, (0, 0))
+    assert index.get_hash("photo", photo) == spg_media.get_perceptual_hash(photo)
+
+
+def test_kept_files_never_flag_others(tmp_path):
+    index = spg_hash_index.PerceptualHashIndex(str(tmp_path / "index.json"), keep=["a"])
+    index.add("b", "00000000000000ff", 1.0)
+    index.add("a", "00000000000000fe", 1.0)
+
+    # The kept copy isn't flagged, and doesn't flag the original either
+    assert index.find_duplicates("00000000000000fe", exclude="a") == []
+    assert index.find_duplicates("00000000000000ff", exclude="b") == []
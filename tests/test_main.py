@@ -0,0 +1,77 @@
+import io
+import os
+
+import pytest
+import yaml
+from google.cloud import storage
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import conftest
+import main
+
+
+class FakeBlob():
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.content_type = "video/mp4"
+        self.etag = "etag"
+
+    def open(self, mode, chunk_size=None):
+        return io.BytesIO(self.data)
+
+
+@pytest.fixture
+def client():
+    # Werkzeug's client, as Flask's test client doesn't support the pinned Werkzeug version
+    return Client(main.app, Response)
+
+
+def test_gcs_credentials_are_scoped():
+    assert conftest.REQUESTED_SCOPES[0] == storage.Client.SCOPE
+
+
+def test_gcs_pool_matches_serving_threads():
+    adapter = main.GCS_CLIENT._http.adapters["https://"]
+    assert adapter._pool_maxsize == main.SERVING_THREADS
+    assert adapter._pool_block
+
+
+def test_get_image_streams_whole_blob(client, monkeypatch):
+    data = bytes(range(256)) * 10000
+    monkeypatch.setattr(main.GCS_BUCKET, "get_blob", lambda path: FakeBlob(data))
+    response = client.get("/get_image/video.mp4")
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == str(len(data))
+    assert response.data == data
+
+
+def test_get_image_range(client, monkeypatch):
+    data = bytes(range(256))
+    monkeypatch.setattr(main.GCS_BUCKET, "get_blob", lambda path: FakeBlob(data))
+    response = client.get("/get_image/video.mp4", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 10-19/256"
+    assert response.data == data[10:20]
+
+    response = client.get("/get_image/video.mp4", headers={"Range": "bytes=300-"})
+    assert response.status_code == 416
+
+
+def test_get_image_not_found(client, monkeypatch):
+    monkeypatch.setattr(main.GCS_BUCKET, "get_blob", lambda path: None)
+    assert client.get("/get_image/missing.jpg").status_code == 404
+
+
+def test_app_yaml_concurrency_matches_serving_threads():
+    # The gunicorn threads, the App Engine request limit and the GCS pool all have to agree
+    with open(os.path.join(conftest.ROOT_DIR, "app.yaml")) as app_yaml_in:
+        app_yaml = yaml.safe_load(app_yaml_in)
+
+    entrypoint = app_yaml["entrypoint"].split()
+    assert entrypoint[entrypoint.index("--workers") + 1] == "1"
+    assert entrypoint[entrypoint.index("--threads") + 1] == "$SERVING_THREADS"
+    serving_threads = int(app_yaml["env_variables"]["SERVING_THREADS"])
+    assert app_yaml["automatic_scaling"]["max_concurrent_requests"] == serving_threads
+    assert main.SERVING_THREADS == serving_threads
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from google.api_core.exceptions import NotFound
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import main
+from build_gallery_script import create_search_index
+
+
+def make_item(taken_at, item_type="image", description=""):
+    return {
+        # As computed by the gallery build, in the build machine's timezone
+        "unix_time": time.mktime(taken_at.timetuple()),
+        "type": item_type,
+        "description": description,
+        "src": "gallery_images/{}.jpg".format(taken_at.isoformat()),
+        "thumbnail": "gallery_thumbnails/{}.jpg".format(taken_at.isoformat()),
+    }
+
+
+@pytest.fixture
+def search_index(tmp_path, monkeypatch):
+    months = {
+        "202106": {
+            "beach.jpg": make_item(datetime(2021, 6, 30, 23, 30), description="Beach day with Grandma"),
+            "park.jpg": make_item(datetime(2021, 6, 5, 10, 0), description="Park &apos;n&apos; beach"),
+        },
+        "202107": {
+            "party.mp4": make_item(datetime(2021, 7, 1, 0, 30), "video", "Birthday party"),
+            "cake.jpg": make_item(datetime(2021, 7, 1, 0, 45), description="Birthday cake"),
+        },
+    }
+    for month, images_data in months.items():
+        with open(os.path.join(tmp_path, "{}.json".format(month)), "w") as images_data_out:
+            json.dump(images_data, images_data_out)
+    create_search_index(str(tmp_path), list(months))
+
+    with open(os.path.join(tmp_path, "search_index.json")) as search_index_in:
+        data = json.load(search_index_in)
+    monkeypatch.setattr(main, "get_gcs_json", lambda filename: data)
+    monkeypatch.setitem(main.SEARCH_INDEX_CACHE, "loaded_at", 0)
+    return data
+
+
+@pytest.fixture
+def client():
+    return Client(main.app, Response)
+
+
+def search(client, query):
+    response = client.get("/api/search?" + query)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    return data["count"], [result["name"] for result in data["results"]]
+
+
+def test_index_layout(search_index):
+    assert search_index["local_time"] == sorted(search_index["local_time"])
+    assert search_index["name"] == ["park.jpg", "beach.jpg", "party.mp4", "cake.jpg"]
+    assert search_index["months"] == ["202106", "202107"]
+    assert search_index["types"] == ["image", "video"]
+    assert search_index["tokens"]["beach"] == [0, 1]
+    assert search_index["tokens"]["n"] == [0]
+    for rows in search_index["tokens"].values():
+        assert rows == sorted(rows)
+
+
+def test_date_range_is_inclusive_and_timezone_independent(client, search_index):
+    assert search(client, "end=2021-06-30") == (2, ["park.jpg", "beach.jpg"])
+    assert search(client, "start=2021-07-01") == (2, ["party.mp4", "cake.jpg"])
+    assert search(client, "start=2021-06-06&end=2021-07-01") == (3, ["beach.jpg", "party.mp4", "cake.jpg"])
+
+
+def test_keywords_are_intersected(client, search_index):
+    assert search(client, "q=beach") == (2, ["park.jpg", "beach.jpg"])
+    assert search(client, "q=Beach+grandma") == (1, ["beach.jpg"])
+    assert search(client, "q=beach+birthday") == (0, [])
+    assert search(client, "q=birthday&end=2021-06-30") == (0, [])
+
+
+def test_type_filter(client, search_index):
+    assert search(client, "type=video") == (1, ["party.mp4"])
+    assert search(client, "type=gif") == (0, [])
+
+
+def test_limit(client, search_index):
+    assert search(client, "limit=1") == (4, ["park.jpg"])
+
+
+@pytest.mark.parametrize("query", ["start=2021-13-01", "end=yesterday", "limit=abc", "limit=0", "limit=-1"])
+def test_invalid_input(client, search_index, query):
+    assert client.get("/api/search?" + query).status_code == 400
+
+
+def test_search_without_index(client, monkeypatch):
+    def missing(filename):
+        raise NotFound(filename)
+
+    monkeypatch.setattr(main, "get_gcs_json", missing)
+    monkeypatch.setitem(main.SEARCH_INDEX_CACHE, "loaded_at", 0)
+    assert client.get("/api/search").status_code == 503
+
+
+def test_index_is_reloaded_once(monkeypatch):
+    loads = []
+
+    def slow_load(filename):
+        loads.append(filename)
+        time.sleep(0.1)
+        return {}
+
+    monkeypatch.setattr(main, "get_gcs_json", slow_load)
+    monkeypatch.setitem(main.SEARCH_INDEX_CACHE, "loaded_at", 0)
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: main.get_search_index(), range(8)))
+    assert len(loads) == 1